@@ -1,29 +1,95 @@
 # main.py
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Literal, List, Optional, Dict, Any
+from typing import Literal, List, Optional, Dict, Any, Set
+import os
 import re
 import json
 import time
+import asyncio
+import hashlib
 
-# We'll use sync playwright to keep code simpler for phone editing.
-from playwright.sync_api import sync_playwright, Error as PlaywrightError
+import httpx
+import orjson
+from cachetools import TTLCache
 
-app = FastAPI(title="Bet Code Converter")
+from playwright.async_api import async_playwright, Playwright, Browser, Error as PlaywrightError
 
-# CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app = FastAPI(title="Bet Code Converter", default_response_class=ORJSONResponse)
+
+# Shared HTTP client (created on startup so TCP/TLS connections are reused)
+_HTTP: Optional[httpx.AsyncClient] = None
+
+# Shared Playwright browser (launched once; each request gets its own context)
+_PW: Optional[Playwright] = None
+_BROWSER: Optional[Browser] = None
+
+_BROWSER_LOCK = asyncio.Lock()
+
+async def _get_browser() -> Optional[Browser]:
+    """
+    Returns the shared browser, (re)launching it if it is missing or has
+    crashed/disconnected. Returns None if Playwright can't start a browser.
+    """
+    global _PW, _BROWSER
+    if _BROWSER is not None and _BROWSER.is_connected():
+        return _BROWSER
+    async with _BROWSER_LOCK:
+        # another request may have relaunched it while we waited
+        if _BROWSER is not None and _BROWSER.is_connected():
+            return _BROWSER
+        try:
+            if _PW is None:
+                _PW = await async_playwright().start()
+            _BROWSER = await _PW.chromium.launch(headless=True, args=["--no-sandbox", "--disable-setuid-sandbox"])
+        except Exception:
+            # Playwright not installed or browser failed; API path still works
+            _BROWSER = None
+    return _BROWSER
+
+@app.on_event("startup")
+async def _startup():
+    global _HTTP
+    _HTTP = httpx.AsyncClient(http2=True, timeout=5)
+    await _get_browser()
+
+@app.on_event("shutdown")
+async def _shutdown():
+    if _HTTP is not None:
+        await _HTTP.aclose()
+    if _BROWSER is not None and _BROWSER.is_connected():
+        await _BROWSER.close()
+    if _PW is not None:
+        await _PW.stop()
+
+# CORS: the bundled frontend is same-origin, so only add the middleware
+# for explicitly listed origins, e.g. CORS_ORIGINS="https://a.com,https://b.com"
+CORS_ORIGINS = [o.strip() for o in os.environ.get("CORS_ORIGINS", "").split(",") if o.strip()]
+if CORS_ORIGINS:
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=CORS_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["GET", "POST"],
+        allow_headers=["Content-Type"],
+        max_age=86400,
+    )
+
+# Fingerprinted assets (e.g. app.3f9a1c2b.js) never change under the same name
+_HASHED_ASSET_RE = re.compile(r"\.[0-9a-f]{8,}\.\w+$")
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles with long-lived caching for fingerprinted assets."""
 
-# Serve frontend from /static
-app.mount("/", StaticFiles(directory="static", html=True), name="static")
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if _HASHED_ASSET_RE.search(os.path.basename(full_path)):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        # other files keep StaticFiles' ETag/Last-Modified (heuristic caching)
+        return response
 
 # ---------------------------
 # Models & small helpers
@@ -33,6 +99,9 @@ class ConvertRequest(BaseModel):
     from_platform: Literal["sportybet", "bet9ja"]
     to_platform: Literal["sportybet", "bet9ja"]
 
+# Booking codes are short alphanumerics; anything else is rejected before scraping
+_CODE_RE = re.compile(r"[A-Za-z0-9]{4,16}")
+
 # Minimal market map you can extend later
 MARKET_MAP = {
     ("sportybet", "1X2"): "Match Result",
@@ -43,28 +112,156 @@ MARKET_MAP = {
     ("bet9ja", "Over/Under 2.5 Goals"): "O/U 2.5",
 }
 
+# MARKET_MAP split per source platform at import: {platform: {market: mapped}}
+_MARKET_MAP_BY_PLATFORM: Dict[str, Dict[str, str]] = {}
+for (_plat, _market), _mapped in MARKET_MAP.items():
+    _MARKET_MAP_BY_PLATFORM.setdefault(_plat, {})[_market] = _mapped
+
 def map_markets(legs: List[Dict[str, Any]], from_plat: str, to_plat: str) -> List[Dict[str, Any]]:
+    submap = _MARKET_MAP_BY_PLATFORM.get(from_plat, {})
     out = []
     for leg in legs:
+        # copy, don't mutate: legs may come from the slip cache
+        leg = leg.copy()
         market_in = leg.get("market", "")
-        mapped = MARKET_MAP.get((from_plat, market_in), market_in)
-        out.append({**leg, "market": mapped})
+        leg["market"] = submap.get(market_in, market_in)
+        out.append(leg)
     return out
 
 def generate_booking_code_for_demo(to_plat: str, source_code: str) -> str:
     prefix = "BJ" if to_plat == "bet9ja" else "SP"
-    return f"{prefix}{abs(hash(source_code)) % 100000:05d}"
+    # blake2b is stable across processes, unlike the salted built-in hash()
+    h = hashlib.blake2b(source_code.encode("utf-8"), digest_size=4).digest()
+    suffix = int.from_bytes(h, "big") % 100000
+    return f"{prefix}{suffix:05d}"
+
+# Booking codes are immutable, so fetched slips can be reused.
+# Misses are kept briefly so failing codes don't relaunch the browser.
+_SLIP_CACHE: TTLCache = TTLCache(maxsize=4096, ttl=600)
+_SLIP_MISS_CACHE: TTLCache = TTLCache(maxsize=4096, ttl=60)
+# Fetches in progress, so concurrent requests for one code share a single fetch.
+# Everything here runs on the event loop, so no lock is needed.
+_SLIP_INFLIGHT: Dict[str, asyncio.Task] = {}
 
 # ---------------------------
-# Playwright scraper for SportyBet
-# - tries a few known URLs and selectors
+# SportyBet scraper
+# - tries the JSON booking API first (fast, no browser)
+# - falls back to Playwright on a few known URLs and selectors
 # - returns standard slip: {"legs":[{home,away,market,pick,odds}, ...]}
 # ---------------------------
-def fetch_sportybet_slip_playwright(code: str, timeout: int = 25) -> Optional[Dict[str, Any]]:
+async def fetch_sportybet_slip_playwright(code: str, timeout: int = 8) -> Optional[Dict[str, Any]]:
+    """
+    Fetches a SportyBet slip via the JSON API, falling back to Playwright.
+    Results are cached per booking code. Returns None on failure.
+    """
+    if not _CODE_RE.fullmatch(code):
+        return None
+
+    if code in _SLIP_CACHE:
+        return _SLIP_CACHE[code]
+    if code in _SLIP_MISS_CACHE:
+        return None
+
+    task = _SLIP_INFLIGHT.get(code)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_sportybet_slip_uncached(code, timeout))
+        _SLIP_INFLIGHT[code] = task
+        task.add_done_callback(lambda _: _SLIP_INFLIGHT.pop(code, None))
+    # shield: one client going away must not cancel the fetch others await
+    return await asyncio.shield(task)
+
+async def _fetch_sportybet_slip_uncached(code: str, timeout: int) -> Optional[Dict[str, Any]]:
+    slip = await fetch_sportybet_slip_api(code)
+    if not slip:
+        slip = await fetch_sportybet_slip_browser(code, timeout)
+
+    if slip:
+        _SLIP_CACHE[code] = slip
+    else:
+        _SLIP_MISS_CACHE[code] = True
+    return slip
+
+async def fetch_sportybet_slip_api(code: str) -> Optional[Dict[str, Any]]:
     """
-    Uses Playwright to open SportyBet share/booking page, extract a slip.
+    Calls SportyBet's JSON booking endpoints directly (no browser render).
     Returns None on failure.
     """
+    if _HTTP is None:
+        return None
+
+    # Candidate API URLs (same idea as the page URLs below)
+    urls = [
+        f"https://www.sportybet.com/api/ng/factsCenter/loadBookingCodeDetail?shareCode={code}",
+        f"https://www.sportybet.com/api/ng/orders/share/{code}",
+    ]
+
+    # Race all URLs; the first one that yields legs wins, the rest are cancelled
+    pending = {asyncio.create_task(_fetch_slip_from_api_url(url)) for url in urls}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=5, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # nothing finished in time
+                return None
+            for task in done:
+                try:
+                    slip = task.result()
+                except Exception:
+                    slip = None
+                if slip:
+                    return slip
+    finally:
+        for task in pending:
+            task.cancel()
+    return None
+
+async def _fetch_slip_from_api_url(url: str) -> Optional[Dict[str, Any]]:
+    try:
+        resp = await _HTTP.get(url)
+        if resp.status_code != 200:
+            return None
+        payload = orjson.loads(resp.content)
+        if not isinstance(payload, dict):
+            return None
+        legs = parse_slip_from_api_payload(payload) or parse_slip_from_payload(payload)
+    except Exception:
+        # network error, timeout, non-JSON or unexpectedly shaped body
+        return None
+    if legs:
+        return {"legs": legs}
+    return None
+
+# Slip containers in priority order, read in one round-trip per URL
+_SLIP_SELECTORS = [
+    "div.share-bet-slip",
+    "div.booking-container",
+    "div.bet-slip",
+    "div.sports-bet-slip",
+    "div[class*='slip']",
+]
+# Any container appearing means the page has rendered its slip
+_SLIP_SELECTORS_CSS = ", ".join(_SLIP_SELECTORS)
+_SLIP_WAIT_MS = 3000
+# innerText of the first match for each selector (null where nothing matches)
+_SLIP_TEXTS_JS = "sels => sels.map(s => { const el = document.querySelector(s); return el ? el.innerText : null; })"
+
+_BLOCKED_RESOURCE_TYPES = {"image", "media", "font", "stylesheet"}
+
+async def _block_heavy_resources(route):
+    if route.request.resource_type in _BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def fetch_sportybet_slip_browser(code: str, timeout: int = 8) -> Optional[Dict[str, Any]]:
+    """
+    Uses the shared Playwright browser to open SportyBet share/booking page, extract a slip.
+    Returns None on failure.
+    """
+    browser = await _get_browser()
+    if browser is None:
+        return None
+
     # Candidate URLs (SportyBet changes, we try a few patterns)
     urls = [
         f"https://www.sportybet.com/ng/m/sporty/booking?bookingCode={code}",
@@ -73,96 +270,180 @@ def fetch_sportybet_slip_playwright(code: str, timeout: int = 25) -> Optional[Di
         f"https://www.sportybet.com/share/{code}",
     ]
 
-    selectors_to_try = [
-        "div.share-bet-slip",
-        "div.booking-container",
-        "div.bet-slip",
-        "div.sports-bet-slip",
-        "div[class*='slip']",
-    ]
-
+    context = None
     try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True, args=["--no-sandbox", "--disable-setuid-sandbox"])
-            page = browser.new_page()
-            page.set_default_timeout(timeout * 1000)
+        context = await browser.new_context()
+        page = await context.new_page()
+        page.set_default_timeout(timeout * 1000)
+        await page.set_extra_http_headers({"Accept-Encoding": "gzip, br"})
+        # Only the document and its scripts matter; skip the heavy stuff
+        await page.route("**/*", _block_heavy_resources)
 
-            for url in urls:
-                try:
-                    page.goto(url)
-                except Exception:
-                    # try next URL
-                    continue
+        for url in urls:
+            try:
+                await page.goto(url, wait_until="domcontentloaded")
+            except Exception:
+                # try next URL
+                continue
+
+            # 1) Try the page's state globals directly (no text scanning)
+            try:
+                payload = await page.evaluate("() => window.__INITIAL_STATE__ || window.__DATA__ || null")
+            except Exception:
+                payload = None
+            if isinstance(payload, dict):
+                legs = parse_slip_from_payload(payload)
+                if legs:
+                    return {"legs": legs}
 
-                # 1) Try to read obvious slip container text
-                for sel in selectors_to_try:
-                    try:
-                        if page.query_selector(sel):
-                            text = page.inner_text(sel)
-                            legs = parse_slip_from_text(text)
-                            if legs:
-                                browser.close()
-                                return {"legs": legs}
-                    except Exception:
-                        continue
-
-                # 2) Try to find embedded JSON in scripts (common)
-                page_html = page.content()
-                payload = extract_json_payload_from_html(page_html)
+            # 2) Try to find embedded JSON in scripts (common)
+            try:
+                scripts = await page.evaluate("() => [...document.scripts].map(s => s.textContent).filter(Boolean)")
+            except Exception:
+                # late navigation / teardown; try next URL
+                continue
+            for script in scripts:
+                payload = extract_json_payload_from_html(script)
                 if payload:
                     legs = parse_slip_from_payload(payload)
                     if legs:
-                        browser.close()
                         return {"legs": legs}
 
-            browser.close()
-    except PlaywrightError as e:
-        # Playwright not installed or browser failed
+            # 3) Try to read obvious slip container text. We only waited for
+            # DOMContentLoaded, so give client-side rendering a moment to fill them
+            try:
+                await page.wait_for_selector(_SLIP_SELECTORS_CSS, timeout=_SLIP_WAIT_MS)
+            except Exception:
+                # nothing rendered in time; try next URL
+                continue
+            try:
+                texts = await page.evaluate(_SLIP_TEXTS_JS, _SLIP_SELECTORS)
+            except Exception:
+                texts = []
+            for text in texts:
+                if not text:
+                    continue
+                legs = parse_slip_from_text(text)
+                if legs:
+                    return {"legs": legs}
+    except PlaywrightError:
+        # browser crashed or context failed
         return None
     except Exception:
         return None
+    finally:
+        if context is not None:
+            try:
+                await context.close()
+            except Exception:
+                pass
     return None
 
+# Compiled once at import; these run per line / per page
+_VS_RE = re.compile(r"(.+?)\s+v(?:s|\.)?\s+(.+)", re.I)
+
+# Anchors for JSON blobs in inline scripts, found in a single pass.
+# Assignments anchor at the "{" after "="; literals anchor at the "{" itself.
+_PAYLOAD_ANCHOR_RE = re.compile(
+    r"(?:window\.__INITIAL_STATE__|window\.__DATA__|var\s+initialState)\s*=\s*(?=\{)"
+    r"|(?=\{\"(?:booking|bets)\")"
+)
+
 def parse_slip_from_text(text: str) -> Optional[List[Dict[str, Any]]]:
     # Try simple "Home vs Away" extraction lines
-    lines = [l.strip() for l in text.splitlines() if l.strip()]
+    lines = (l.strip() for l in text.splitlines())
     legs = []
     for line in lines:
-        m = re.search(r"(.+?)\s+v(?:s|\.)?\s+(.+)", line, flags=re.I)
-        if not m:
-            m = re.search(r"(.+?)\s+vs\s+(.+)", line, flags=re.I)
+        if not line:
+            continue
+        # cheap prescan: _VS_RE can't match without a "v"
+        if "v" not in line and "V" not in line:
+            continue
+        m = _VS_RE.search(line)
         if m:
             home = m.group(1).strip()
             away = m.group(2).strip()
             legs.append({"home": home, "away": away, "market": "Unknown", "pick": "", "odds": None})
     return legs if legs else None
 
+# Decodes one JSON value at a given offset (in C, string/escape aware) and
+# stops at the first invalid token, so a broken blob costs no full rescan.
+_JSON_DECODER = json.JSONDecoder()
+
+# Each failed decode costs O(offset) to build its error, so bound the attempts
+_MAX_PAYLOAD_ATTEMPTS = 32
+
 def extract_json_payload_from_html(html: str) -> Optional[Dict]:
     # Search for JSON blobs in inline scripts
-    patterns = [
-        r"window\.__INITIAL_STATE__\s*=\s*({.*?});",
-        r"window\.__DATA__\s*=\s*({.*?});",
-        r"var\s+initialState\s*=\s*({.*?});",
-        r"({\"booking\".*?})",
-        r"({\"bets\".*?})",
-    ]
-    for pat in patterns:
-        m = re.search(pat, html, flags=re.S)
-        if not m:
+    scanned_to = 0
+    attempts = 0
+    for m in _PAYLOAD_ANCHOR_RE.finditer(html):
+        start = m.end()
+        if start < scanned_to:
+            # nested in a blob that already failed; don't parse that region again
             continue
+        attempts += 1
+        if attempts > _MAX_PAYLOAD_ATTEMPTS:
+            break
         try:
-            payload = json.loads(m.group(1))
+            payload, _ = _JSON_DECODER.raw_decode(html, start)
+        except json.JSONDecodeError as e:
+            scanned_to = e.pos
+            continue
+        except ValueError:
+            continue
+        if isinstance(payload, dict):
             return payload
-        except Exception:
-            # sometimes there is trailing JS; try a best-effort cleanup
-            txt = m.group(1)
-            try:
-                # remove trailing commas etc. This is best-effort and may fail.
-                return json.loads(txt)
-            except Exception:
-                continue
     return None
 
+def _coerce_odds(odds: Any) -> Optional[float]:
+    # JSON numbers need no try/except; only strings can fail to parse
+    if isinstance(odds, float):
+        return odds
+    if isinstance(odds, int):
+        return float(odds)
+    if isinstance(odds, str) and odds:
+        try:
+            return float(odds)
+        except ValueError:
+            return None
+    return None
+
+def parse_slip_from_api_payload(payload: Dict) -> Optional[List[Dict[str, Any]]]:
+    """
+    Parses SportyBet's booking API envelope:
+    {"bizCode": ..., "data": {"outcomes": [{"homeTeamName", "awayTeamName",
+     "markets": [{"desc", "outcomes": [{"desc", "odds"}]}]}]}}
+    One leg per selected outcome. Returns None if the shape doesn't match.
+    """
+    data = payload.get("data")
+    if not isinstance(data, dict):
+        return None
+    events = data.get("outcomes")
+    if not isinstance(events, list):
+        return None
+    legs = []
+    for ev in events:
+        if not isinstance(ev, dict):
+            continue
+        home = ev.get("homeTeamName") or ""
+        away = ev.get("awayTeamName") or ""
+        for mk in ev.get("markets") or []:
+            if not isinstance(mk, dict):
+                continue
+            market = mk.get("desc") or ""
+            for oc in mk.get("outcomes") or []:
+                if not isinstance(oc, dict):
+                    continue
+                legs.append({
+                    "home": home,
+                    "away": away,
+                    "market": market,
+                    "pick": oc.get("desc") or "",
+                    "odds": _coerce_odds(oc.get("odds")),
+                })
+    return legs if legs else None
+
 def parse_slip_from_payload(payload: Dict) -> Optional[List[Dict[str, Any]]]:
     # Try common keys
     for key in ("booking", "slip", "bets", "items", "data"):
@@ -172,15 +453,13 @@ def parse_slip_from_payload(payload: Dict) -> Optional[List[Dict[str, Any]]]:
         if isinstance(data, list):
             legs = []
             for it in data:
+                if not isinstance(it, dict):
+                    continue
                 home = it.get("home") or it.get("team1") or it.get("homeName") or ""
                 away = it.get("away") or it.get("team2") or it.get("awayName") or ""
                 market = it.get("market") or it.get("marketName") or it.get("type") or ""
                 pick = it.get("pick") or it.get("selection") or ""
-                odds = it.get("odds") or it.get("price") or it.get("odd") or None
-                try:
-                    odds = float(odds) if odds else None
-                except Exception:
-                    odds = None
+                odds = _coerce_odds(it.get("odds") or it.get("price") or it.get("odd") or None)
                 legs.append({"home": home, "away": away, "market": market, "pick": pick, "odds": odds})
             if legs:
                 return legs
@@ -190,16 +469,19 @@ def parse_slip_from_payload(payload: Dict) -> Optional[List[Dict[str, Any]]]:
 # API endpoints
 # ---------------------------
 @app.post("/api/convert")
-def convert(req: ConvertRequest):
+async def convert(req: ConvertRequest):
     # If from==to, reject
     if req.from_platform == req.to_platform:
         return {"ok": False, "message": "From/To platforms are the same.", "converted_code": None, "preview": None}
 
+    if not _CODE_RE.fullmatch(req.code):
+        return {"ok": False, "message": "Invalid booking code format.", "converted_code": None, "preview": None}
+
     slip = None
 
     # Only sportybet scraping implemented here. Bet9ja could be added with similar logic.
     if req.from_platform == "sportybet":
-        slip = fetch_sportybet_slip_playwright(req.code)
+        slip = await fetch_sportybet_slip_playwright(req.code)
     elif req.from_platform == "bet9ja":
         # For now keep a demo fallback (you can implement Bet9ja scraping later)
         demo = {
@@ -225,25 +507,33 @@ def health():
 # ---------------------------
 class ConnectionManager:
     def __init__(self):
-        self.active: List[WebSocket] = []
+        self.active: Set[WebSocket] = set()
+        self._send_limit = asyncio.Semaphore(256)
 
     async def connect(self, ws: WebSocket):
         await ws.accept()
-        self.active.append(ws)
+        self.active.add(ws)
 
     def disconnect(self, ws: WebSocket):
-        if ws in self.active:
-            self.active.remove(ws)
+        self.active.discard(ws)
 
     async def broadcast(self, message: str):
-        to_remove = []
-        for conn in self.active:
-            try:
-                await conn.send_text(message)
-            except Exception:
-                to_remove.append(conn)
-        for c in to_remove:
-            self.disconnect(c)
+        # snapshot: connections may come and go while we await sends
+        snapshot = list(self.active)
+        # one ASGI message shared by every socket (send_text builds a new one each call)
+        event = {"type": "websocket.send", "text": message}
+        results = await asyncio.gather(
+            *(self._send(conn, event) for conn in snapshot),
+            return_exceptions=True,
+        )
+        for conn, result in zip(snapshot, results):
+            if isinstance(result, Exception):
+                self.disconnect(conn)
+
+    async def _send(self, conn: WebSocket, event: Dict[str, Any]):
+        # bound concurrent writes for very large rooms
+        async with self._send_limit:
+            await conn.send(event)
 
 manager = ConnectionManager()
 
@@ -256,3 +546,7 @@ async def websocket_chat(websocket: WebSocket):
             await manager.broadcast(text)
     except WebSocketDisconnect:
         manager.disconnect(websocket)
+
+# Serve frontend (static/ directory) at "/". Mounted last: it matches every
+# path, so API and WebSocket routes must be registered before it.
+app.mount("/", CachedStaticFiles(directory="static", html=True), name="static")
@@ -10,4 +10,8 @@ pip install -r requirements.txt
 playwright install chromium
 
 # 3) Start Uvicorn
-exec uvicorn main:app --host 0.0.0.0 --port $PORT
+# uvloop/httptools come with uvicorn[standard].
+# Keep a single worker: /ws/chat connections, the slip cache and the shared
+# browser all live in-process, so extra workers would split chat rooms and
+# each launch their own Chromium. Scaling out needs a shared broker first.
+exec uvicorn main:app --host 0.0.0.0 --port $PORT --workers 1 --loop uvloop --http httptools